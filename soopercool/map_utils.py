@@ -1,10 +1,20 @@
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import healpy as hp
+import ducc0
+from astropy.io import fits
+from astropy import wcs as pywcs
 from pixell import enmap, enplot
 import matplotlib.pyplot as plt
 from pixell import uharm
 import pymaster as nmt
 
+_PIX_TYPES = frozenset(("hp", "car"))
+_DEG2RAD = np.pi / 180.
+_FWHM2SIGMA = 1. / np.sqrt(8. * np.log(2.))
+
 
 def _check_pix_type(pix_type):
     """
@@ -15,11 +25,12 @@ def _check_pix_type(pix_type):
     pix_type : str
         Pixellization type.
     """
-    if not (pix_type in ['hp', 'car']):
+    if pix_type not in _PIX_TYPES:
         raise ValueError(f"Unknown pixelisation type {pix_type}.")
 
 
-def ud_grade(map_in, nside_out, power=None, pix_type='hp'):
+def ud_grade(map_in, nside_out, power=None, pix_type='hp',
+             method="pixel"):
     """
     Utility function to upgrade or downgrade a map.
     Only support the healpix pixellization type.
@@ -34,6 +45,10 @@ def ud_grade(map_in, nside_out, power=None, pix_type='hp'):
         Set to -2 to keep the sum invariant (for hits)
     pix_type : str, optional
         Pixellization type.
+    method : str, optional
+        "pixel" averages (or sums) sub-pixels as `hp.ud_grade` does.
+        "harmonic" band-limits the map to lmax = 2*nside_out in
+        harmonic space, which is the correct choice for Q/U maps.
 
     Returns
     -------
@@ -42,9 +57,103 @@ def ud_grade(map_in, nside_out, power=None, pix_type='hp'):
     """
     if pix_type != 'hp':
         raise ValueError("Can't U/D-grade non-HEALPix maps")
+    if method not in ["pixel", "harmonic"]:
+        raise ValueError(f"Unknown U/D-grade method {method}.")
+    nside_in = hp.npix2nside(np.shape(map_in)[-1])
+    if method == "harmonic":
+        if power is not None:
+            raise ValueError("Harmonic U/D-grade does not support `power`")
+        return _ud_grade_harmonic_hp(map_in, nside_in, nside_out,
+                                     _get_nthreads())
+    if (power == -2 and nside_out < nside_in
+            and np.issubdtype(map_in.dtype, np.integer)):
+        return _downgrade_hits_hp(map_in, nside_in, nside_out)
     return hp.ud_grade(map_in, nside_out=nside_out, power=power)
 
 
+def _ud_grade_harmonic_hp(map_in, nside_in, nside_out, nthreads):
+    """
+    Hidden function to upgrade or downgrade a HEALPix map in harmonic
+    space with ducc0: the map is transformed on the input grid up to
+    lmax = 2*nside_out and synthesized on the output grid.
+    3-component maps are treated as (T, Q, U), with a spin-2 transform
+    for polarization, other maps component-wise.
+
+    Parameters
+    ----------
+    map_in : np.ndarray
+        Input map.
+    nside_in : int
+        Input nside.
+    nside_out : int
+        Output nside.
+    nthreads : int
+        Number of threads.
+
+    Returns
+    -------
+    map_out : np.ndarray
+        Output map.
+    """
+    lmax = min(2 * nside_out, 3 * nside_in - 1)
+    # Bad (UNSEEN) pixels are set to zero before the transform, and
+    # output pixels overlapping any of them are marked UNSEEN.
+    bad = hp.mask_bad(map_in)
+    map_in = np.asarray(map_in, dtype=np.float64)
+    if bad.any():
+        map_in = np.where(bad, 0, map_in)
+    npix_out = hp.nside2npix(nside_out)
+
+    if map_in.ndim == 2 and map_in.shape[0] == 3:
+        map_out = np.empty((3, npix_out))
+        alm_T = _map2alm_hp(map_in[None, :1], nside_in, lmax, 0, nthreads)
+        map_out[:1] = _alm2map_hp(alm_T, nside_out, lmax, 0, nthreads)[0]
+        alm_P = _map2alm_hp(map_in[None, 1:], nside_in, lmax, 2, nthreads)
+        map_out[1:] = _alm2map_hp(alm_P, nside_out, lmax, 2, nthreads)[0]
+    else:
+        maps = map_in.reshape(-1, 1, map_in.shape[-1])
+        alm = _map2alm_hp(maps, nside_in, lmax, 0, nthreads)
+        map_out = _alm2map_hp(alm, nside_out, lmax, 0, nthreads)
+        map_out = map_out.reshape(map_in.shape[:-1] + (npix_out,))
+
+    if bad.any():
+        bad_out = hp.ud_grade(bad.astype(np.float64), nside_out) > 0
+        map_out[bad_out] = hp.UNSEEN
+    return map_out
+
+
+def _downgrade_hits_hp(map_in, nside_in, nside_out):
+    """
+    Hidden function to downgrade an integer HEALPix hit map, keeping
+    the sum invariant (`power=-2`). In NESTED ordering, each output
+    pixel is a contiguous block of input pixels, so the downgrade is a
+    reshape and a sum over blocks, accumulated in int64 to avoid
+    overflowing small integer types.
+
+    Parameters
+    ----------
+    map_in : np.ndarray
+        Input RING-ordered map.
+    nside_in : int
+        Input nside.
+    nside_out : int
+        Output nside, smaller than `nside_in`.
+
+    Returns
+    -------
+    map_out : np.ndarray
+        Output int64 map.
+    """
+    npix_in = hp.nside2npix(nside_in)
+    npix_out = hp.nside2npix(nside_out)
+    block = npix_in // npix_out
+
+    m = map_in.astype(np.int64, copy=False)
+    m = m[..., hp.nest2ring(nside_in, np.arange(npix_in))]
+    sums = m.reshape(m.shape[:-1] + (npix_out, block)).sum(axis=-1)
+    return sums[..., hp.ring2nest(nside_out, np.arange(npix_out))]
+
+
 def lmax_from_map(map, pix_type="hp"):
     """
     Determine the maximum multipole from a map and its
@@ -64,13 +173,70 @@ def lmax_from_map(map, pix_type="hp"):
     """
     _check_pix_type(pix_type)
     if pix_type == "hp":
-        nside = hp.npix2nside(map.shape[-1])
-        return 3 * nside - 1
+        return _lmax_hp(map.shape[-1])
     else:
-        _, wcs = map.geometry
-        res = np.deg2rad(np.min(np.abs(wcs.wcs.cdelt)))
-        lmax = uharm.res2lmax(res)
-        return lmax
+        return _lmax_car(tuple(map.wcs.wcs.cdelt))
+
+
+@functools.lru_cache(maxsize=32)
+def _lmax_hp(npix):
+    """
+    Hidden function returning the maximum multipole of a HEALPix map
+    with `npix` pixels. Cached, since it is called repeatedly on maps
+    sharing the same resolution.
+
+    Parameters
+    ----------
+    npix : int
+        Number of pixels.
+
+    Returns
+    -------
+    int
+        Maximum multipole.
+    """
+    nside = hp.npix2nside(npix)
+    return 3 * nside - 1
+
+
+@functools.lru_cache(maxsize=32)
+def _lmax_car(cdelt):
+    """
+    Hidden function returning the maximum multipole of a CAR map
+    from its pixel sizes. Cached, since it is called repeatedly on
+    maps sharing the same geometry.
+
+    Parameters
+    ----------
+    cdelt : tuple
+        WCS pixel sizes in degrees.
+
+    Returns
+    -------
+    int
+        Maximum multipole.
+    """
+    res = min(abs(c) for c in cdelt) * _DEG2RAD
+    lmax = uharm.res2lmax(res)
+    return lmax
+
+
+def _is_hdf5(map_file):
+    """
+    Determine whether a map file uses the HDF5 storage backend,
+    based on its extension.
+
+    Parameters
+    ----------
+    map_file : str
+        Map file name.
+
+    Returns
+    -------
+    bool
+        True for HDF5 files.
+    """
+    return map_file.endswith((".h5", ".hdf5", ".hdf"))
 
 
 def _get_pix_type(map_file):
@@ -91,6 +257,38 @@ def _get_pix_type(map_file):
     """
     if "fits.gz" in map_file:
         return "hp"
+    stat = os.stat(map_file)
+    return _get_pix_type_cached(map_file, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_pix_type_cached(map_file, mtime_ns, size):
+    """
+    Hidden function reading the pixellization type from the header of
+    an uncompressed map file. Cached on the file modification time and
+    size, so that repeated calls on an unchanged file do not re-parse
+    it, while rewritten files are read again.
+
+    Parameters
+    ----------
+    map_file : str
+        Map file name.
+    mtime_ns : int
+        Modification time of the file, in nanoseconds.
+    size : int
+        Size of the file, in bytes.
+
+    Returns
+    -------
+    str
+        Pixellization type.
+    """
+    if _is_hdf5(map_file):
+        import h5py
+
+        # pixell stores the WCS header of CAR maps in a "wcs" group.
+        with h5py.File(map_file, "r") as f:
+            return "car" if "wcs" in f else "hp"
 
     header = enmap.read_fits_header(map_file)
     if "WCSAXES" in header:
@@ -99,13 +297,117 @@ def _get_pix_type(map_file):
         return "hp"
 
 
+def _read_map_hp(map_file, fields_hp=None):
+    """
+    Hidden function to read a HEALPix map. Uncompressed, full-sky,
+    RING-ordered FITS files are read through a memory map of the binary
+    table, with all requested fields gathered in a single pass. All other
+    cases are delegated to `hp.read_map`.
+
+    Parameters
+    ----------
+    map_file : str
+        Map file name.
+    fields_hp : int or str or tuple, optional
+        Fields to read from the HEALPix map.
+
+    Returns
+    -------
+    map_out : np.ndarray
+        Loaded map.
+    """
+    field = 0 if fields_hp is None else fields_hp
+    if map_file.endswith(".fits"):
+        with fits.open(map_file, memmap=True, mode="readonly") as hdul:
+            hdu = hdul[1]
+            header = hdu.header
+            is_full_ring = (
+                isinstance(hdu, fits.BinTableHDU)
+                and header.get("ORDERING", "RING").strip() != "NESTED"
+                and header.get("INDXSCHM", "IMPLICIT").strip() != "EXPLICIT"
+                and str(header.get("OBJECT", "FULLSKY")).strip() != "PARTIAL"
+            )
+            if is_full_ring:
+                cols = [hdu.data.field(f).ravel()
+                        for f in np.atleast_1d(field)]
+                if hp.isnpixok(cols[0].size):
+                    # FITS data are big-endian: the byte swap into the
+                    # output array is the only copy made.
+                    dtype = np.result_type(
+                        *[c.dtype.newbyteorder("=") for c in cols]
+                    )
+                    m = np.empty((len(cols), cols[0].size), dtype=dtype)
+                    for i, c in enumerate(cols):
+                        m[i] = c
+                    # Like `hp.read_map`, single fields are returned as 1D.
+                    return m[0] if len(cols) == 1 else m
+
+    kwargs = {"field": fields_hp} if fields_hp is not None else {}
+    return hp.read_map(map_file, **kwargs)
+
+
+def _read_map_h5(map_file, fields_hp=None):
+    """
+    Hidden function to read a HEALPix map from an HDF5 file written
+    by `write_map`. As with `hp.read_map`, only the first field is
+    read from multi-component maps unless `fields_hp` is given.
+
+    Parameters
+    ----------
+    map_file : str
+        Map file name.
+    fields_hp : int or tuple, optional
+        Fields to read from the HEALPix map.
+
+    Returns
+    -------
+    map_out : np.ndarray
+        Loaded map.
+    """
+    import h5py
+
+    with h5py.File(map_file, "r") as f:
+        dset = f["map"]
+        if dset.ndim == 1:
+            return dset[()]
+        field = 0 if fields_hp is None else fields_hp
+        if np.ndim(field) == 0:
+            return dset[field]
+        return np.stack([dset[i] for i in field])
+
+
+def _write_map_h5(map_file, map, dtype=None):
+    """
+    Hidden function to write a HEALPix map to a chunked,
+    LZF-compressed HDF5 file, under the "map" dataset.
+
+    Parameters
+    ----------
+    map_file : str
+        Map file name.
+    map : np.ndarray
+        Map to write.
+    dtype : np.dtype, optional
+        Data type.
+    """
+    import h5py
+
+    map = np.asarray(map)
+    chunks = map.shape[:-1] + (min(map.shape[-1], 3072),)
+    with h5py.File(map_file, "w") as f:
+        f.create_dataset("map", data=map, dtype=dtype, chunks=chunks,
+                         compression="lzf")
+
+
 def read_map(map_file,
              pix_type='hp',
              fields_hp=None,
              convert_K_to_muK=False,
-             geometry=None):
+             geometry=None,
+             dtype=None):
     """
     Read a map from a file, regardless of the pixellization type.
+    Files with a .h5, .hdf5 or .hdf extension are read from HDF5.
 
     Parameters
     ----------
@@ -119,6 +421,9 @@ def read_map(map_file,
         Convert K to muK.
     geometry : enmap.geometry, optional
         Enmap geometry.
+    dtype : np.dtype, optional
+        Data type of the output map (e.g. np.float32 to halve memory).
+        If None, the data type of the file is kept.
 
     Returns
     -------
@@ -130,18 +435,31 @@ def read_map(map_file,
         conv = 1.e6
     _check_pix_type(pix_type)
     if pix_type == 'hp':
-        kwargs = {"field": fields_hp} if fields_hp is not None else {}
-        m = hp.read_map(map_file, **kwargs)
+        if _is_hdf5(map_file):
+            m = _read_map_h5(map_file, fields_hp=fields_hp)
+        else:
+            m = _read_map_hp(map_file, fields_hp=fields_hp)
     else:
-        m = enmap.read_map(map_file, geometry=geometry)
+        fmt = "hdf" if _is_hdf5(map_file) else None
+        m = enmap.read_map(map_file, fmt=fmt, geometry=geometry)
 
-    return conv*m
+    if dtype is not None:
+        m = m.astype(dtype, copy=False)
+    if conv != 1:
+        # Freshly loaded maps are owned by us, so float maps are
+        # scaled in place. Integer maps are promoted as before.
+        if np.issubdtype(m.dtype, np.floating):
+            np.multiply(m, conv, out=m)
+        else:
+            m = m * conv
+    return m
 
 
 def write_map(map_file, map, dtype=None, pix_type='hp',
               convert_muK_to_K=False):
     """
     Write a map to a file, regardless of the pixellization type.
+    Files with a .h5, .hdf5 or .hdf extension are written to HDF5.
 
     Parameters
     ----------
@@ -157,15 +475,255 @@ def write_map(map_file, map, dtype=None, pix_type='hp',
         Convert muK to K.
     """
     if convert_muK_to_K:
-        map *= 1.e-6
+        # Scale into a new array rather than modifying the caller's
+        # map in place. Casting to `dtype` is left to the writers.
+        map = map * 1.e-6
     _check_pix_type(pix_type)
     if pix_type == 'hp':
-        hp.write_map(map_file, map, overwrite=True, dtype=dtype)
+        if _is_hdf5(map_file):
+            _write_map_h5(map_file, map, dtype=dtype)
+        else:
+            hp.write_map(map_file, map, overwrite=True, dtype=dtype)
+    else:
+        fmt = "hdf" if _is_hdf5(map_file) else None
+        enmap.write_map(map_file, map, fmt=fmt)
+
+
+def _get_nthreads():
+    """
+    Number of threads used by the ducc0 spherical harmonic transforms.
+    Follows the first level of OMP_NUM_THREADS if it is a positive
+    integer, and uses the CPUs available to this process (honouring
+    the affinity set by MPI/SLURM) otherwise.
+
+    Returns
+    -------
+    int
+        Number of threads.
+    """
+    omp = os.environ.get("OMP_NUM_THREADS", "").split(",")[0].strip()
+    if omp.isdigit() and int(omp) > 0:
+        return int(omp)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _get_sht_backend():
+    """
+    Backend used for HEALPix spherical harmonic transforms, set by the
+    SOOPERCOOL_SHT_BACKEND environment variable ("ducc0" by default,
+    or "healpy").
+
+    Returns
+    -------
+    str
+        SHT backend.
+    """
+    backend = os.environ.get("SOOPERCOOL_SHT_BACKEND", "ducc0")
+    if backend not in ["ducc0", "healpy"]:
+        raise ValueError(f"Unknown SHT backend {backend}.")
+    return backend
+
+
+def _map2alm_hp(map, nside, lmax, spin, nthreads, niter=3):
+    """
+    Hidden function computing the harmonic coefficients of a stack of
+    RING-ordered HEALPix maps with ducc0. Like `hp.map2alm`, the
+    quadrature is refined with `niter` Jacobi iterations.
+
+    Parameters
+    ----------
+    map : np.ndarray
+        Input maps, with shape (ntrans, ncomp, npix), where ncomp is 1
+        for spin-0 and 2 for spin-2 transforms.
+    nside : int
+        HEALPix nside.
+    lmax : int
+        Maximum multipole.
+    spin : int
+        Spin of the transform.
+    nthreads : int
+        Number of threads.
+    niter : int, optional
+        Number of Jacobi iterations.
+
+    Returns
+    -------
+    alm : np.ndarray
+        Harmonic coefficients, in the healpy triangular layout.
+    """
+    geom = ducc0.healpix.Healpix_Base(nside, "RING").sht_info()
+    kwargs = {"lmax": lmax, "spin": spin, "nthreads": nthreads, **geom}
+    pix_area = 4 * np.pi / map.shape[-1]
+
+    alm = ducc0.sht.experimental.adjoint_synthesis(map=map, **kwargs)
+    alm *= pix_area
+    if niter == 0:
+        return alm
+
+    # Scratch buffers are reused across the Jacobi iterations.
+    residual = np.empty_like(map)
+    dalm = np.empty_like(alm)
+    for _ in range(niter):
+        ducc0.sht.experimental.synthesis(alm=alm, map=residual, **kwargs)
+        np.subtract(map, residual, out=residual)
+        ducc0.sht.experimental.adjoint_synthesis(map=residual, alm=dalm,
+                                                 **kwargs)
+        dalm *= pix_area
+        alm += dalm
+    return alm
+
+
+def _alm2map_hp(alm, nside, lmax, spin, nthreads, map_out=None):
+    """
+    Hidden function synthesizing a stack of RING-ordered HEALPix maps
+    from their harmonic coefficients with ducc0.
+
+    Parameters
+    ----------
+    alm : np.ndarray
+        Harmonic coefficients, with shape (ntrans, ncomp, nalm).
+    nside : int
+        HEALPix nside.
+    lmax : int
+        Maximum multipole.
+    spin : int
+        Spin of the transform.
+    nthreads : int
+        Number of threads.
+    map_out : np.ndarray, optional
+        Output buffer, with shape (ntrans, ncomp, npix).
+
+    Returns
+    -------
+    map : np.ndarray
+        Output maps, with shape (ntrans, ncomp, npix).
+    """
+    geom = ducc0.healpix.Healpix_Base(nside, "RING").sht_info()
+    return ducc0.sht.experimental.synthesis(
+        alm=alm, map=map_out, lmax=lmax, spin=spin, nthreads=nthreads,
+        **geom
+    )
+
+
+def _smooth_hp_ducc(map, fwhm_rad, lmax, nthreads, dtype=np.float64):
+    """
+    Hidden function applying a Gaussian smoothing to a HEALPix map
+    using ducc0 spherical harmonic transforms. This reproduces
+    `hp.smoothing`: 3-component maps are smoothed as (T, Q, U) using
+    the spin-2 beam for polarization, other maps component-wise.
+
+    Parameters
+    ----------
+    map : np.ndarray
+        Input map.
+    fwhm_rad : float
+        FWHM in radians.
+    lmax : int
+        Maximum multipole.
+    nthreads : int
+        Number of threads.
+    dtype : np.dtype, optional
+        Floating-point type of the transforms and of the output map.
+
+    Returns
+    -------
+    map_out : np.ndarray
+        Smoothed map.
+    """
+    nside = hp.npix2nside(map.shape[-1])
+    # As in `hp.smoothing`, bad (UNSEEN) pixels are set to zero
+    # before the transform, and back to UNSEEN in the output.
+    bad = hp.mask_bad(map)
+    map = np.asarray(map, dtype=dtype)
+    if bad.any():
+        map = np.where(bad, 0, map)
+    ell, _ = hp.Alm.getlm(lmax)
+    sigma = fwhm_rad * _FWHM2SIGMA
+    beam = np.exp(-0.5 * ell * (ell + 1) * sigma**2)
+
+    # Smoothed maps are synthesized directly into the output array.
+    map_out = np.empty(map.shape, dtype=dtype)
+    if map.ndim == 2 and map.shape[0] == 3:
+        alm_T = _map2alm_hp(map[None, :1], nside, lmax, 0, nthreads)
+        alm_T *= beam
+        _alm2map_hp(alm_T, nside, lmax, 0, nthreads,
+                    map_out=map_out[None, :1])
+        alm_P = _map2alm_hp(map[None, 1:], nside, lmax, 2, nthreads)
+        alm_P *= beam * np.exp(2 * sigma**2)
+        _alm2map_hp(alm_P, nside, lmax, 2, nthreads,
+                    map_out=map_out[None, 1:])
     else:
-        enmap.write_map(map_file, map)
+        maps = map.reshape(-1, 1, map.shape[-1])
+        alm = _map2alm_hp(maps, nside, lmax, 0, nthreads)
+        alm *= beam
+        _alm2map_hp(alm, nside, lmax, 0, nthreads,
+                    map_out=map_out.reshape(maps.shape))
+    map_out[bad] = hp.UNSEEN
+    return map_out
 
 
-def smooth_map(map, fwhm_deg, pix_type="hp"):
+@functools.lru_cache(maxsize=16)
+def _laxes_car(shape, wcs_header):
+    """
+    Hidden function returning the 1D multipole axes of the Fourier
+    grid of a CAR map, as in `enmap.laxes`. Cached, since they are
+    reused for every map sharing the same geometry.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the last two (pixel) axes of the map.
+    wcs_header : str
+        WCS of the map, as a FITS header string.
+
+    Returns
+    -------
+    ly, lx : np.ndarray
+        Read-only multipoles along the y and x axes.
+    """
+    wcs = pywcs.WCS(fits.Header.fromstring(wcs_header))
+    ly, lx = enmap.laxes(shape, wcs)
+    ly.setflags(write=False)
+    lx.setflags(write=False)
+    return ly, lx
+
+
+def _smooth_hp(map, fwhm_rad, nthreads, dtype=None):
+    """
+    Hidden function applying a Gaussian smoothing to a HEALPix map with
+    the SHT backend selected by `_get_sht_backend`.
+
+    Parameters
+    ----------
+    map : np.ndarray
+        Input map.
+    fwhm_rad : float
+        FWHM in radians.
+    nthreads : int
+        Number of threads of the ducc0 transforms.
+    dtype : np.dtype, optional
+        Floating-point type of the output map.
+
+    Returns
+    -------
+    map_out : np.ndarray
+        Smoothed map.
+    """
+    if _get_sht_backend() == "healpy":
+        map_out = hp.smoothing(map, fwhm=fwhm_rad)
+        if dtype is not None:
+            map_out = map_out.astype(dtype, copy=False)
+        return map_out
+    nside = hp.npix2nside(map.shape[-1])
+    if dtype is None:
+        dtype = np.float64
+    return _smooth_hp_ducc(map, fwhm_rad, 3*nside-1, nthreads, dtype=dtype)
+
+
+def smooth_map(map, fwhm_deg, pix_type="hp", dtype=None,
+               independent=False):
     """
     Apply a Gaussian smoothing to a map with
     a given FWHM in degrees.
@@ -178,6 +736,14 @@ def smooth_map(map, fwhm_deg, pix_type="hp"):
         FWHM in degrees.
     pix_type : str, optional
         Pixellization type.
+    dtype : np.dtype, optional
+        Floating-point type in which the smoothing is computed
+        (e.g. np.float32). If None, float64 is used for HEALPix maps
+        and the map data type is kept for CAR maps.
+    independent : bool, optional
+        Smooth the components of a multi-component HEALPix map as
+        independent scalar maps, in parallel threads, instead of as
+        (T, Q, U).
 
     Returns
     -------
@@ -185,11 +751,31 @@ def smooth_map(map, fwhm_deg, pix_type="hp"):
         Smoothed map.
     """
     _check_pix_type(pix_type)
+    fwhm_rad = fwhm_deg * _DEG2RAD
     if pix_type == "hp":
-        return hp.smoothing(map, fwhm=np.deg2rad(fwhm_deg))
+        if independent and map.ndim == 2:
+            # The SHTs release the GIL: components run concurrently,
+            # sharing the available threads.
+            ncomp = map.shape[0]
+            nthreads = max(1, _get_nthreads() // ncomp)
+            with ThreadPoolExecutor(max_workers=ncomp) as executor:
+                maps_out = executor.map(
+                    lambda m: _smooth_hp(m, fwhm_rad, nthreads, dtype),
+                    map
+                )
+                return np.array(list(maps_out))
+        return _smooth_hp(map, fwhm_rad, _get_nthreads(), dtype)
     else:
-        sigma_deg = fwhm_deg / np.sqrt(8 * np.log(2))
-        return enmap.smooth_gauss(map, np.deg2rad(sigma_deg))
+        if dtype is not None:
+            map = map.astype(dtype, copy=False)
+        ly, lx = _laxes_car(map.shape[-2:], map.wcs.to_header_string())
+        sigma_rad = fwhm_rad * _FWHM2SIGMA
+        # The Gaussian taper exp(-l^2 sigma^2 / 2) is separable in
+        # (ly, lx), so it is applied as two 1D factors.
+        ft = enmap.fft(map)
+        ft *= np.exp(-0.5 * ly**2 * sigma_rad**2)[:, None]
+        ft *= np.exp(-0.5 * lx**2 * sigma_rad**2)
+        return enmap.ifft(ft).real
 
 
 def _plot_map_hp(map, lims=None, file_name=None, title=None):
@@ -211,29 +797,20 @@ def _plot_map_hp(map, lims=None, file_name=None, title=None):
     title : str, optional
         Plot title.
     """
-    ncomp = map.shape[0] if len(map.shape) == 2 else 1
+    map = np.atleast_2d(map)
+    ncomp = map.shape[0]
     cmap = "YlOrRd" if ncomp == 1 else "RdYlBu_r"
     if lims is None:
         range_args = [{} for i in range(ncomp)]
+    else:
+        lims = np.reshape(lims, (ncomp, 2))
+        range_args = [{"min": vmin, "max": vmax} for vmin, vmax in lims]
 
-    if ncomp == 1 and lims is not None:
-        range_args = [{
-            "min": lims[0],
-            "max": lims[1]
-        }]
-    if ncomp == 3 and lims is not None:
-        range_args = [
-            {
-                "min": lims[i][0],
-                "max": lims[i][1]
-            } for i in lims(3)
-        ]
     for i in range(ncomp):
         if ncomp != 1:
             f = "TQU"[i]
-        print("np.shape(map)", np.shape(np.atleast_2d(map)))
         hp.mollview(
-            np.atleast_2d(map)[i],
+            map[i],
             cmap=cmap,
             title=title,
             **range_args[i],
@@ -275,10 +852,8 @@ def _plot_map_car(map, lims=None, file_name=None):
             "max": lims[1]
         }
     if ncomp == 3 and lims is not None:
-        range_args = {
-            "min": [lims[i][0] for i in range(ncomp)],
-            "max": [lims[i][1] for i in range(ncomp)]
-        }
+        lims = np.reshape(lims, (ncomp, 2))
+        range_args = {"min": lims[:, 0].tolist(), "max": lims[:, 1].tolist()}
 
     plot = enplot.plot(
          map,
@@ -327,7 +902,8 @@ def plot_map(map, file_name=None, lims=None, title=None, pix_type="hp"):
         _plot_map_car(map, lims, file_name=file_name)
 
 
-def apodize_mask(mask, apod_radius_deg, apod_type, pix_type="hp"):
+def apodize_mask(mask, apod_radius_deg, apod_type, pix_type="hp",
+                 dtype=None):
     """
     Apodize a mask with a given apod radius and type regardless
     of the pixellization type.
@@ -343,6 +919,9 @@ def apodize_mask(mask, apod_radius_deg, apod_type, pix_type="hp"):
         Apodization type
     pix_type : str, optional
         Pixellization type.
+    dtype : np.dtype, optional
+        Floating-point type of the apodized mask (e.g. np.float32).
+        For CAR masks, the apodization kernel is also evaluated in it.
 
     Returns
     -------
@@ -356,28 +935,44 @@ def apodize_mask(mask, apod_radius_deg, apod_type, pix_type="hp"):
             apod_radius_deg,
             apod_type
         )
+        if dtype is not None:
+            mask_apo = mask_apo.astype(dtype, copy=False)
     else:
-        distance = enmap.distance_transform(mask)
-        distance = np.rad2deg(distance)
-
-        mask_apo = mask.copy()
-        idx = np.where(distance > apod_radius_deg)
+        import numexpr as ne
 
         if apod_type == "C1":
-            mask_apo = 0.5 - 0.5 * np.cos(-np.pi * distance / apod_radius_deg)
+            # Integer literals only: numexpr would upcast float32
+            # evaluations for double ones such as 0.5.
+            kernel = "(1 - cos(pi * x)) / 2"
         elif apod_type == "C2":
-            mask_apo = (
-                distance / apod_radius_deg -
-                np.sin(2 * np.pi * distance / apod_radius_deg) / (2 * np.pi)
-            )
+            kernel = "x - sin(2 * pi * x) / (2 * pi)"
         else:
             raise ValueError(f"Unknown apodization type {apod_type}")
-        mask_apo[idx] = 1
+
+        # Both kernels reach 1 at x = 1, so clamping the scaled
+        # distance replaces the scatter of ones beyond the radius.
+        # The distance map (in radians) is the only full-size
+        # intermediate: it is scaled to units of the radius and
+        # clamped in place.
+        x = enmap.distance_transform(mask)
+        if dtype is not None:
+            x = x.astype(dtype, copy=False)
+        x /= apod_radius_deg * _DEG2RAD
+        np.minimum(x, 1., out=x)
+        # pi is passed with the dtype of x so that numexpr does not
+        # upcast single-precision evaluations.
+        mask_apo = ne.evaluate(
+            f"m * ({kernel})",
+            local_dict={"m": np.asarray(mask, dtype=dtype), "x": x,
+                        "pi": x.dtype.type(np.pi)}
+        )
+        mask_apo = enmap.ndmap(mask_apo, mask.wcs)
 
     return mask_apo
 
 
-def template_from_map(map, ncomp, pix_type="hp"):
+def template_from_map(map, ncomp, pix_type="hp", fill=0., touch=True,
+                      dtype=None):
     """
     Generate a template from a map regardless of the pixellization type.
 
@@ -389,22 +984,43 @@ def template_from_map(map, ncomp, pix_type="hp"):
         Number of components of the output template.
     pix_type : str, optional
         Pixellization type.
+    fill : float, optional
+        Value of the template pixels.
+    touch : bool, optional
+        If False, return a read-only broadcast view of `fill` instead of
+        allocating the template. Use it when the template only carries
+        the geometry, and `.copy()` it to get writable storage.
+    dtype : np.dtype, optional
+        Data type of the template. Defaults to the floating-point type
+        of the input map.
 
     Returns
     -------
     template : np.ndarray or enmap.ndmap
-        Template.
+        Template. Unless `dtype` is given, it has the floating-point
+        dtype of the input map (float64 for integer maps such as
+        binary masks).
     """
     _check_pix_type(pix_type)
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+    else:
+        dtype = map.dtype
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.dtype(np.float64)
     if pix_type == "hp":
-        if map.shape > 1:
+        if map.ndim > 1:
             new_shape = (ncomp,) + map.shape[1:]
         else:
-            new_shape = (ncomp, len(map))
-        return np.zeros(new_shape)
+            new_shape = (ncomp, map.shape[-1])
+        if not touch:
+            return np.broadcast_to(dtype.type(fill), new_shape)
+        return np.full(new_shape, fill, dtype=dtype)
 
     else:
         shape, wcs = map.geometry
         new_shape = (ncomp,) + shape[-2:]
-
-        return enmap.zeros(new_shape, wcs)
+        if not touch:
+            return enmap.ndmap(np.broadcast_to(dtype.type(fill), new_shape),
+                               wcs)
+        return enmap.full(new_shape, wcs, fill, dtype=dtype)
@@ -0,0 +1,266 @@
+"""
+Unit tests for the soopercool.map_utils module.
+"""
+import numpy as np
+import healpy as hp
+from pixell import enmap
+from soopercool import map_utils as mu
+
+nside = 32
+fwhm_deg = 1.
+
+
+def _random_map(ncomp=None, seed=1234):
+    rng = np.random.default_rng(seed)
+    shape = (hp.nside2npix(nside),)
+    if ncomp is not None:
+        shape = (ncomp,) + shape
+    return rng.standard_normal(shape)
+
+
+def _car_geometry(res_deg=2.):
+    return enmap.fullsky_geometry(res=np.deg2rad(res_deg))
+
+
+def test_smooth_map_hp_unseen():
+    m = _random_map()
+    m[np.arange(10) * 100] = hp.UNSEEN
+    m_ref = hp.smoothing(m, fwhm=np.deg2rad(fwhm_deg))
+    m_out = mu.smooth_map(m, fwhm_deg)
+    np.testing.assert_allclose(m_out, m_ref, rtol=0, atol=1e-8)
+
+
+def test_ud_grade_int():
+    rng = np.random.default_rng(1234)
+    nside_out = nside // 4
+    for dtype in [np.uint8, np.int32]:
+        # Binary masks keep the dtype and values of `hp.ud_grade`.
+        mask = rng.integers(0, 2, hp.nside2npix(nside)).astype(dtype)
+        mask_ref = hp.ud_grade(mask, nside_out=nside_out)
+        mask_out = mu.ud_grade(mask, nside_out)
+        assert mask_out.dtype == mask_ref.dtype
+        np.testing.assert_array_equal(mask_out, mask_ref)
+
+        # Hit counts are summed exactly.
+        hits = rng.integers(0, 10, hp.nside2npix(nside)).astype(dtype)
+        hits_ref = hp.ud_grade(hits.astype(np.float64), nside_out=nside_out,
+                               power=-2)
+        hits_out = mu.ud_grade(hits, nside_out, power=-2)
+        np.testing.assert_array_equal(hits_out, hits_ref)
+        assert hits_out.sum() == hits.astype(np.int64).sum()
+
+
+def test_apodize_mask_car_dtype():
+    shape, wcs = _car_geometry()
+    mask = enmap.ones(shape, wcs)
+    mask[30:60, 60:120] = 0.
+    for apod_type in ["C1", "C2"]:
+        mask_apo = mu.apodize_mask(mask, 10., apod_type, pix_type="car")
+        mask_apo32 = mu.apodize_mask(mask, 10., apod_type, pix_type="car",
+                                     dtype=np.float32)
+        assert mask_apo.dtype == np.float64
+        assert mask_apo32.dtype == np.float32
+        np.testing.assert_allclose(mask_apo32, mask_apo, rtol=0, atol=1e-6)
+        assert np.all(mask_apo[mask == 0] == 0)
+        assert np.all((mask_apo >= 0) & (mask_apo <= 1))
+
+
+def test_smooth_map_hp():
+    fwhm_rad = np.deg2rad(fwhm_deg)
+    for m in [_random_map(), _random_map(ncomp=3)]:
+        m_ref = hp.smoothing(m, fwhm=fwhm_rad)
+        m_out = mu.smooth_map(m, fwhm_deg)
+        assert m_out.shape == m.shape
+        np.testing.assert_allclose(m_out, m_ref, rtol=0, atol=1e-8)
+
+
+def test_get_nthreads(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "4,2")
+    assert mu._get_nthreads() == 4
+    for omp in ["", "0", "auto"]:
+        monkeypatch.setenv("OMP_NUM_THREADS", omp)
+        assert mu._get_nthreads() >= 1
+    monkeypatch.delenv("OMP_NUM_THREADS")
+    assert mu._get_nthreads() >= 1
+
+
+def test_read_map_hp(tmp_path):
+    m = _random_map(ncomp=3)
+    fname = str(tmp_path / "map.fits")
+
+    # RING files are read through the memory map.
+    hp.write_map(fname, m, overwrite=True)
+    np.testing.assert_array_equal(mu.read_map(fname), hp.read_map(fname))
+    np.testing.assert_array_equal(mu.read_map(fname, fields_hp=1),
+                                  hp.read_map(fname, field=1))
+    m_muK = mu.read_map(fname, convert_K_to_muK=True)
+    np.testing.assert_allclose(m_muK, 1.e6 * m[0], rtol=1e-6)
+
+    # NESTED files are reordered to RING.
+    hp.write_map(fname, hp.reorder(m, r2n=True), nest=True, overwrite=True)
+    np.testing.assert_array_equal(mu.read_map(fname), hp.read_map(fname))
+    np.testing.assert_allclose(mu.read_map(fname), m[0], rtol=1e-6)
+
+
+def test_read_write_map_hdf5(tmp_path):
+    # HEALPix
+    m = _random_map(ncomp=3)
+    fname = str(tmp_path / "map.h5")
+    mu.write_map(fname, m)
+    assert mu._get_pix_type(fname) == "hp"
+    np.testing.assert_array_equal(mu.read_map(fname), m[0])
+    np.testing.assert_array_equal(mu.read_map(fname, fields_hp=(0, 1, 2)),
+                                  m)
+    mu.write_map(fname, m, dtype=np.float32)
+    assert mu.read_map(fname, fields_hp=(0, 1, 2)).dtype == np.float32
+
+    # CAR
+    shape, wcs = _car_geometry()
+    m = enmap.ones((3,) + shape, wcs)
+    fname = str(tmp_path / "map_car.h5")
+    mu.write_map(fname, m, pix_type="car")
+    assert mu._get_pix_type(fname) == "car"
+    m_out = mu.read_map(fname, pix_type="car")
+    np.testing.assert_array_equal(m_out, m)
+    np.testing.assert_allclose(m_out.wcs.wcs.cdelt, wcs.wcs.cdelt)
+
+
+def test_ud_grade_harmonic_unseen():
+    nside_out = nside // 2
+    m = _random_map()
+    m[np.arange(100) * 100] = hp.UNSEEN
+    bad_out = hp.ud_grade(hp.mask_bad(m).astype(float), nside_out) > 0
+    m_out = mu.ud_grade(m, nside_out, method="harmonic")
+    assert np.all(m_out[bad_out] == hp.UNSEEN)
+    assert np.max(np.abs(m_out[~bad_out])) < 10.
+
+
+def test_ud_grade():
+    nside_out = nside // 2
+    m = _random_map(ncomp=3)
+    np.testing.assert_allclose(mu.ud_grade(m, nside_out),
+                               hp.ud_grade(m, nside_out=nside_out))
+    np.testing.assert_allclose(mu.ud_grade(m[0], nside * 2),
+                               hp.ud_grade(m[0], nside_out=nside * 2))
+
+    # Band-limited maps are resampled exactly in harmonic space.
+    lmax = 2 * nside_out
+    rng = np.random.default_rng(1234)
+    nalm = hp.Alm.getsize(lmax)
+    alm = (rng.standard_normal((3, nalm))
+           + 1j * rng.standard_normal((3, nalm)))
+    alm[:, :lmax + 1] = alm[:, :lmax + 1].real
+    m_in = hp.alm2map(alm, nside, lmax=lmax)
+    m_ref = hp.alm2map(alm, nside_out, lmax=lmax)
+    m_out = mu.ud_grade(m_in, nside_out, method="harmonic")
+    np.testing.assert_allclose(m_out, m_ref, rtol=0,
+                               atol=1e-6 * np.max(np.abs(m_ref)))
+
+
+def test_smooth_map_car():
+    shape, wcs = _car_geometry()
+    rng = np.random.default_rng(1234)
+    m = enmap.ndmap(rng.standard_normal((3,) + shape), wcs)
+    sigma_deg = fwhm_deg * 5 / np.sqrt(8 * np.log(2))
+    m_ref = enmap.smooth_gauss(m, np.deg2rad(sigma_deg))
+    m_out = mu.smooth_map(m, fwhm_deg * 5, pix_type="car")
+    np.testing.assert_allclose(m_out, m_ref, rtol=0, atol=1e-10)
+    # Repeated calls reuse the cached multipole axes.
+    m_out = mu.smooth_map(m, fwhm_deg * 5, pix_type="car")
+    np.testing.assert_allclose(m_out, m_ref, rtol=0, atol=1e-10)
+
+
+def test_template_from_map():
+    npix = hp.nside2npix(nside)
+    for m in [_random_map(), _random_map(ncomp=2)]:
+        template = mu.template_from_map(m, ncomp=3)
+        assert template.shape == (3, npix)
+        assert np.all(template == 0)
+        template[:] = 1.
+
+        template = mu.template_from_map(m, ncomp=3, fill=2., touch=False)
+        assert template.shape == (3, npix)
+        assert np.all(template == 2.)
+        assert not template.flags.writeable
+        template = template.copy()
+        assert template.flags.writeable
+        template[:] = 1.
+
+    shape, wcs = _car_geometry()
+    m = enmap.ones(shape, wcs)
+    template = mu.template_from_map(m, ncomp=3, pix_type="car")
+    assert isinstance(template, enmap.ndmap)
+    assert template.shape == (3,) + shape
+    assert np.all(template == 0)
+    template = mu.template_from_map(m, ncomp=3, pix_type="car", touch=False)
+    assert isinstance(template, enmap.ndmap)
+    assert template.shape == (3,) + shape
+    assert not template.flags.writeable
+    template = template.copy()
+    assert template.flags.writeable
+    np.testing.assert_allclose(template.wcs.wcs.cdelt, wcs.wcs.cdelt)
+    np.testing.assert_allclose(template.wcs.wcs.crpix, wcs.wcs.crpix)
+
+
+def test_template_from_map_dtype():
+    shape, wcs = _car_geometry()
+    maps = {"hp": _random_map(ncomp=3), "car": enmap.ones(shape, wcs)}
+    for pix_type, m in maps.items():
+        for dtype_in, dtype_out in [(np.float64, np.float64),
+                                    (np.float32, np.float32),
+                                    (np.int32, np.float64),
+                                    (np.uint8, np.float64)]:
+            m_in = m.astype(dtype_in)
+            for touch in [True, False]:
+                template = mu.template_from_map(m_in, ncomp=3,
+                                                pix_type=pix_type,
+                                                touch=touch)
+                assert template.dtype == dtype_out
+        template = mu.template_from_map(m, ncomp=3, pix_type=pix_type,
+                                        dtype=np.float32)
+        assert template.dtype == np.float32
+
+
+def test_read_map_hp_multi_field(tmp_path):
+    m = _random_map(ncomp=3)
+    fname = str(tmp_path / "map.fits")
+
+    hp.write_map(fname, m, overwrite=True)
+    for field in [(0, 1, 2), (2, 0), [1]]:
+        np.testing.assert_array_equal(mu.read_map(fname, fields_hp=field),
+                                      hp.read_map(fname, field=field))
+    m_muK = mu.read_map(fname, fields_hp=(0, 1, 2), convert_K_to_muK=True)
+    np.testing.assert_allclose(m_muK, 1.e6 * m, rtol=1e-6)
+
+    # NESTED files are reordered to RING.
+    hp.write_map(fname, hp.reorder(m, r2n=True), nest=True, overwrite=True)
+    np.testing.assert_array_equal(
+        mu.read_map(fname, fields_hp=(0, 1, 2)),
+        hp.read_map(fname, field=(0, 1, 2))
+    )
+    np.testing.assert_allclose(mu.read_map(fname, fields_hp=(0, 1, 2)), m,
+                               rtol=1e-6)
+
+
+def test_get_pix_type_cache(tmp_path):
+    fname = str(tmp_path / "map.fits")
+    hp.write_map(fname, _random_map(), overwrite=True)
+    assert mu._get_pix_type(fname) == "hp"
+    assert mu._get_pix_type(fname) == "hp"
+
+    # Rewriting the same path must not return the cached type.
+    shape, wcs = _car_geometry()
+    enmap.write_map(fname, enmap.ones(shape, wcs))
+    assert mu._get_pix_type(fname) == "car"
+    hp.write_map(fname, _random_map(), overwrite=True)
+    assert mu._get_pix_type(fname) == "hp"
+
+
+def test_smooth_map_hp_independent():
+    fwhm_rad = np.deg2rad(fwhm_deg)
+    m = _random_map(ncomp=3)
+    m[1, np.arange(10) * 100] = hp.UNSEEN
+    m_ref = np.array([hp.smoothing(mi, fwhm=fwhm_rad) for mi in m])
+    m_out = mu.smooth_map(m, fwhm_deg, independent=True)
+    assert m_out.shape == m.shape
+    np.testing.assert_allclose(m_out, m_ref, rtol=0, atol=1e-8)